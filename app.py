@@ -1,3 +1,5 @@
+import functools
+
 import pandas as pd
 from pandas.api.types import CategoricalDtype
 import numpy as np
@@ -6,7 +8,7 @@ import numpy as np
 import dash
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 
 import dash_bootstrap_components as dbc
 
@@ -16,6 +18,8 @@ import plotly.graph_objs as go
 # Key parameters
 release_date = 'July 2023'
 # release_date = 'February 2024'
+# release to compare against in the "change between releases" view
+compare_release_date = 'February 2024'
 # ===================================
 def sort_status(df):
     """
@@ -44,18 +48,29 @@ layout_chosen = '2 columns'  # options: '1 column', '2 columns'
 # filepath = 'https://github.com/GlobalEnergyMonitor/GOGPT-dashboard/blob/main/data/Global%20Oil%20and%20Gas%20Plant%20Tracker%20(GOGPT)%20compiled%202023-08-18%20-%20processed%20for%20Dash%202023-09-18_1621.xlsx?raw=true'
 filepath = 'https://github.com/GlobalEnergyMonitor/GOGPT-dashboard/blob/main/data/Global%20Oil%20and%20Gas%20Plant%20Tracker%20(GOGPT)%20compiled%202023-08-18%20-%20processed%20for%20Dash%202023-10-17_1906.xlsx?raw=true'
 # filepath = 'https://github.com/GlobalEnergyMonitor/GOGPT-dashboard/blob/main/data/Global%20Oil%20and%20Gas%20Plant%20Tracker%20(GOGPT)%20compiled%20own-par%202024-02-16%20-%20processed%20for%20Dash%202024-02-16_1845.xlsx?raw=true'
+compare_filepath = 'https://github.com/GlobalEnergyMonitor/GOGPT-dashboard/blob/main/data/Global%20Oil%20and%20Gas%20Plant%20Tracker%20(GOGPT)%20compiled%20own-par%202024-02-16%20-%20processed%20for%20Dash%202024-02-16_1845.xlsx?raw=true'
 
 # # ===================================
-dash_data_xl = pd.ExcelFile(filepath, engine='openpyxl')
+@functools.lru_cache(maxsize=None)
+def load_dash_data(filepath):
+    """
+    read the four sheets of a processed release (map, status, age, additions)
+    cached so that each release is only downloaded once
+    """
+    dash_data_xl = pd.ExcelFile(filepath, engine='openpyxl')
+
+    gogpt_map = pd.read_excel(dash_data_xl, sheet_name='map')
+    gogpt_status = pd.read_excel(dash_data_xl, sheet_name='status')
+    gogpt_age = pd.read_excel(dash_data_xl, sheet_name='age')
+    gogpt_add = pd.read_excel(dash_data_xl, sheet_name='additions')
 
-gogpt_map = pd.read_excel(dash_data_xl, sheet_name='map')
-gogpt_status = pd.read_excel(dash_data_xl, sheet_name='status')
-gogpt_age = pd.read_excel(dash_data_xl, sheet_name='age')
-gogpt_add = pd.read_excel(dash_data_xl, sheet_name='additions')
+    # clean status df
+    gogpt_status = sort_status(gogpt_status)
 
-# clean status df
+    return gogpt_map, gogpt_status, gogpt_age, gogpt_add
 
-gogpt_status = sort_status(gogpt_status)
+
+gogpt_map, gogpt_status, gogpt_age, gogpt_add = load_dash_data(filepath)
 
 # create list of countries to choose from (GEM country names)
 # data in gogpt_status is most complete; 
@@ -79,6 +94,17 @@ dropdown_options_list_of_dicts = []  # initialize
 for country in gogpt_country_list_for_dropdown:
     dropdown_options_list_of_dicts += [{'label': country, 'value': country}] 
 
+# countries in either release, for the change view
+# (e.g. countries newly tracked in the comparison release)
+compare_country_list = load_dash_data(compare_filepath)[1]['Country'].unique().tolist()
+gogpt_country_list_change = sorted(
+    (set(gogpt_country_list) | set(compare_country_list)) - {'all'}
+)
+
+dropdown_options_change = []  # initialize
+for country in ['all'] + gogpt_country_list_change:
+    dropdown_options_change += [{'label': country, 'value': country}] 
+
 # create dropdown menu
 country_dropdown = dcc.Dropdown(
     id='country_dropdown',
@@ -87,6 +113,19 @@ country_dropdown = dcc.Dropdown(
     placeholder='Select a country' # only shows up if user clears entry
 )
 
+# ===================================
+# ### Create view selector: latest release, or change between releases
+
+view_radio = dcc.RadioItems(
+    id='view_radio',
+    options=[
+        {'label': f' {release_date} release', 'value': 'release'},
+        {'label': f' Change from {release_date} to {compare_release_date}', 'value': 'change'},
+    ],
+    value='release', # default starting value
+    labelStyle={'display': 'block'},
+)
+
 # ===================================
 # ===================================
 # ## Create graphs
@@ -484,6 +523,365 @@ fig_add = create_chart_additions(
     sel_country='all'
 )
 
+# ===================================
+# ### Change between releases
+# Each sheet of the two releases is aligned on integer-coded keys (country, status, year, ...)
+# and differenced in one vectorized join. This is done once at start-up, 
+# so the callback only has to select the rows for the chosen country.
+
+def diff_releases(df_from, df_to, keys, value_cols, time_key=None):
+    """
+    return the change (df_to minus df_from) in value_cols, aligned on keys
+    duplicate keys within a release are summed before aligning
+    rows that only exist in one of the releases (e.g. a newly tracked country) 
+    are treated as zero in the other
+    except for time_key: a period that only one release covers is not a change of zero, 
+    so only the range of time_key covered by both releases is kept
+    """
+    if time_key is not None:
+        shared_min = max(df_from[time_key].min(), df_to[time_key].min())
+        shared_max = min(df_from[time_key].max(), df_to[time_key].max())
+        df_from = df_from[df_from[time_key].between(shared_min, shared_max)]
+        df_to = df_to[df_to[time_key].between(shared_min, shared_max)]
+
+    # shared set of categories per key, so that both releases get the same integer codes
+    categories = {}
+    for key in keys:
+        if isinstance(df_from[key].dtype, CategoricalDtype):
+            categories[key] = df_from[key].cat.categories
+        else:
+            key_values = pd.concat([df_from[key], df_to[key]]).dropna().unique()
+            categories[key] = pd.Index(key_values).sort_values()
+
+    def encode(df):
+        df_coded = df[value_cols].copy()
+        for key in keys:
+            df_coded[key] = pd.Categorical(df[key], categories=categories[key]).codes
+        # rows with a missing key (code -1) can't be aligned, e.g. map rows without a GEM country
+        df_coded = df_coded[(df_coded[keys] >= 0).all(axis=1)]
+        # e.g. the February 2024 additions sheet has each 'all' row twice (once with 0)
+        df_coded = df_coded.groupby(keys, as_index=False)[value_cols].sum()
+        return df_coded
+
+    merged = pd.merge(
+        encode(df_from), 
+        encode(df_to), 
+        on=keys, 
+        how='outer', 
+        suffixes=(' from', ' to'),
+        validate='one_to_one',
+    )
+    delta_values = (
+        merged[[f'{col} to' for col in value_cols]].fillna(0).to_numpy()
+        - merged[[f'{col} from' for col in value_cols]].fillna(0).to_numpy()
+    )
+    df_delta = pd.DataFrame(delta_values, columns=value_cols, index=merged.index)
+
+    # decode keys back to their original values
+    for key in keys:
+        if isinstance(df_from[key].dtype, CategoricalDtype):
+            df_delta[key] = pd.Categorical.from_codes(merged[key], categories=categories[key])
+        else:
+            df_delta[key] = categories[key].take(merged[key]).to_numpy()
+
+    df_delta = df_delta[keys + value_cols].sort_values(by=keys).reset_index(drop=True)
+    
+    return df_delta
+
+
+def compute_release_deltas(filepath_from, filepath_to):
+    """
+    change in each sheet between two processed releases
+    status is compared between each release's latest snapshot (e.g. H1 2023 vs H2 2023), 
+    because the later release adds a period that the earlier one doesn't have
+    additions are only compared for start years that are complete in both releases
+    """
+    map_from, status_from, age_from, add_from = load_dash_data(filepath_from)
+    map_to, status_to, age_to, add_to = load_dash_data(filepath_to)
+
+    gogpt_map_delta = diff_releases(
+        map_from, map_to, 
+        keys=['Country', 'iso_alpha'], 
+        value_cols=['Capacity (MW)'],
+    )
+
+    status_snapshot_years = (status_from['Year'].max(), status_to['Year'].max())
+    gogpt_status_delta = diff_releases(
+        status_from[status_from['Year'] == status_snapshot_years[0]], 
+        status_to[status_to['Year'] == status_snapshot_years[1]], 
+        keys=['Country', 'Status'], 
+        value_cols=['Capacity (MW)'],
+    )
+    gogpt_age_delta = diff_releases(
+        age_from, age_to, 
+        keys=['Country', 'Decade'], 
+        value_cols=list(age_tech_pallette),
+    )
+    # a release with an H1 snapshot only has half of its final start year 
+    # (e.g. H1 2023 snapshot: 2023 is partial); snapshot 2023.5 (H1 2023) 
+    # and 2024.0 (H2 2023) both have int(year) - 1 as their last full year
+    last_full_year = int(min(status_snapshot_years)) - 1
+    gogpt_add_delta = diff_releases(
+        add_from[add_from['Year'] <= last_full_year], 
+        add_to[add_to['Year'] <= last_full_year], 
+        keys=['Country', 'Year'], 
+        value_cols=['Added (MW)'],
+        time_key='Year',
+    )
+
+    return gogpt_map_delta, gogpt_status_delta, gogpt_age_delta, gogpt_add_delta, status_snapshot_years
+
+
+change_title = f'Change from {release_date} to {compare_release_date}'
+
+
+def half_year_label(year):
+    """
+    label for bi-annual status data: 
+    2023.5 is H1 2023; 2023.0 is H2 2022
+    """
+    if year % 1 == 0.5:
+        return f'H1 {int(year)}'
+    else:
+        return f'H2 {int(year) - 1}'
+
+
+def create_chart_choro_delta(gogpt_map_delta, sel_country):
+    # signed log scale, so that small and large changes are both visible
+    delta = gogpt_map_delta['Capacity (MW)']
+    z_delta = np.sign(delta) * np.log10(delta.abs() + 1)
+    max_val = max(int(np.ceil(z_delta.abs().max())), 1)
+
+    # Prepare the range of the colorbar (symmetric around zero)
+    values = [i for i in range(-max_val, max_val+1)]
+    ticks = ['0' if i == 0 else f'{int(np.sign(i)) * 10**abs(i):+,}' for i in values]
+
+    if sel_country == 'all':
+        sel_resolution = 110
+        sel_rows = delta.index
+    else:
+        sel_resolution = 50
+        sel_rows = gogpt_map_delta.index[gogpt_map_delta['Country'] == sel_country]
+
+    gogpt_map_sel = gogpt_map_delta.loc[sel_rows]
+    hover_text = (
+        gogpt_map_sel['Country'].astype(str) + ': ' 
+        + gogpt_map_sel['Capacity (MW)'].map('{:+,.0f} MW'.format) 
+        + '<extra></extra>'
+    )
+
+    fig_map = go.Figure(
+        data=go.Choropleth(
+            colorscale='RdBu',
+            colorbar={
+                'title': 'Change (MW)',
+                'tickvals': values,
+                'ticktext': ticks,
+            },
+            locationmode='ISO-3',
+            zauto=False,
+            zmin=-max_val,
+            zmax=max_val,
+            zmid=0,
+
+            locations=gogpt_map_sel['iso_alpha'],
+            z=z_delta.loc[sel_rows],
+            hovertemplate=hover_text,
+    ))
+
+    fig_map.update_layout(
+        title_text=f'<b>Change in Operating Gas & Oil Power Capacity by Country</b><br>{change_title}',
+        margin={'r': 100, 't': 100, 'l': 60, 'b': 150},
+        title_x=0.5,
+        dragmode=False,
+        geo=dict(
+                showframe=False,
+                showcoastlines=False,
+                projection_type='equirectangular',
+                resolution=sel_resolution,
+                visible=True,
+            ),
+    )
+    fig_map.add_annotation(dict(font=dict(color='dark blue',size=12),
+                        x=.05,
+                        y=-0.6,
+                        align='left',
+                        showarrow=False,
+                        text=
+                            f'Change in total operating gas and oil power capacity by country ' +
+                            f'<br>between the {release_date} and {compare_release_date} data releases. ' +
+                            '<br>Hover over each country on the map to see the change in capacity.',
+                        textangle=0,
+                        xanchor='left',
+                        xref= 'paper',
+                        yref= 'paper',
+                        )
+    )
+    fig_map.update_geos(fitbounds="locations", visible=True)
+
+    return fig_map
+
+
+def create_chart_by_status_delta(gogpt_status_delta, sel_country, status_snapshot_years):
+    fig_status = go.Figure() # initialize
+    df = gogpt_status_delta[gogpt_status_delta['Country']==sel_country]
+    statuses = df['Status'].unique().tolist()
+
+    for status in statuses:
+        df_status = df[df['Status']==status]
+        color_status = gogpt_map_colors[status]['color']
+
+        fig_status.add_trace(go.Bar(
+            x=df_status['Status'], 
+            y=df_status['Capacity (MW)'], 
+            name=status, 
+            marker_color=color_status,
+            hovertemplate=status + ': %{y:+,.0f} MW<extra></extra>'
+        ))
+
+    snapshot_from, snapshot_to = [half_year_label(year) for year in status_snapshot_years]
+    fig_status.update_layout(
+        barmode='relative',
+        title=f'<b>Change in Gas & Oil Power Capacity by Status</b><br>{snapshot_from} to {snapshot_to}',
+        title_x=0.5,
+        margin={'r': 10, 't': 100, 'l': 100, 'b': 150},
+        yaxis=dict(
+            title='Change (MW)',
+        ),
+        xaxis = dict(
+        tickangle=0
+        ),
+        legend=dict(
+            yanchor='top',
+            y=1,
+            xanchor='left',
+            x=1,
+            traceorder='normal',
+        ),
+    )
+    fig_status.add_annotation(dict(font=dict(color='dark blue',size=12),
+                        x=.02,
+                        y=-0.5,
+                        align='left',
+                        showarrow=False,
+                        text=
+                            f'Change in oil and gas power capacity by status from {snapshot_from} ' +
+                            f'<br>(latest in the {release_date} data release) to {snapshot_to} ' +
+                            f'<br>(latest in the {compare_release_date} data release).',
+                        textangle=0,
+                        xanchor='left',
+                        xref='paper',
+                        yref='paper')
+    )
+    return fig_status
+
+
+def create_chart_age_type_delta(gogpt_age_delta, sel_country):
+    fig_age = go.Figure() # initialize
+
+    decades = ['0-9 years', '10-19 years', '20-29 years', '30-39 years', '40-49 years', '50+ years']
+    df = gogpt_age_delta[gogpt_age_delta['Country'] == sel_country].drop('Country', axis=1)
+    df = df.set_index('Decade')
+    df = df.reindex(decades, fill_value=0)
+
+    for technology in age_tech_pallette:
+        fig_age.add_trace(go.Bar(
+            name=technology,
+            x=df[technology], 
+            y=df.index, 
+            orientation='h',
+            marker_color=age_tech_pallette[technology],
+            hovertemplate=technology + ': %{x:+,.0f} MW<extra></extra>',
+        ))
+
+    fig_age.update_layout(
+        barmode='relative',
+        title=f'<b>Change in Operating Gas & Oil Power Capacity by Age and Type</b><br>{change_title}',
+        title_x=0.5,
+        margin={'r': 100, 't': 100, 'l': 60, 'b': 150},
+        xaxis=dict(
+            title='Change (MW)',
+        ),
+        legend=dict(
+            orientation='h',
+            yanchor='top',
+            y=1,
+            xanchor='left',
+            x=1,
+            traceorder='normal',
+        ),
+    )
+    fig_age.add_annotation(dict(font=dict(color='dark blue',size=12),
+                        x=.02,
+                        y=-0.6,
+                        showarrow=False,
+                        text=
+                        'Change in operating oil and gas power capacity by age and technology type' +
+                        f'<br>between the {release_date} and {compare_release_date} data releases.',
+                        textangle=0,
+                        xanchor='left',
+                        align='left',
+                        xref='paper',
+                        yref='paper')
+    )
+
+    # reverse axis to put youngest at the top
+    fig_age['layout']['yaxis']['autorange'] = "reversed"
+
+    return fig_age
+
+
+def create_chart_additions_delta(gogpt_add_delta, sel_country):
+    fig_add = go.Figure() # initialize figure
+
+    df = gogpt_add_delta[gogpt_add_delta['Country']==sel_country]
+
+    fig_add.add_trace(go.Bar(
+        x=df['Year'], 
+        y=df['Added (MW)'],
+        name='Added', 
+        marker_color='#680266',
+        hovertemplate='Added: %{y:+,.0f} MW<extra></extra>',
+    ))
+
+    fig_add.update_layout(
+        title=f'<b>Change in Gas & Oil Power Capacity Added</b><br>{change_title}',
+        title_x=0.5,
+        margin={'r': 10, 't': 100, 'l': 100, 'b': 150},
+        yaxis=dict(
+            title='Change (MW)',
+        ),
+        xaxis = dict(
+            title='Plant Start Year',
+        ),
+    )
+    fig_add.add_annotation(dict(font=dict(color='dark blue',size=12),
+                        x=.02,
+                        y=-0.5,
+                        align='left',
+                        showarrow=False,
+                        text=
+                            'Change in annual oil and gas power capacity additions by start year ' +
+                            f'<br>between the {release_date} and {compare_release_date} data releases. ' +
+                            '<br>Only start years covered in full by both releases are shown.',
+                        textangle=0,
+                        xanchor='left',
+                        xref='paper',
+                        yref='paper')
+    )
+
+    return fig_add
+
+# compute changes once at start-up (like the release data above), 
+# so that the callback only selects rows for the chosen country
+(
+    gogpt_map_delta, 
+    gogpt_status_delta, 
+    gogpt_age_delta, 
+    gogpt_add_delta, 
+    status_snapshot_years,
+) = compute_release_deltas(filepath, compare_filepath)
+
 # ===================================
 # Create app & server
 
@@ -500,6 +898,11 @@ server = app.server
 # Create graphs of charts
 
 dropdown_title = html.H5(children='Select a country:', style={'marginLeft': 10, 'marginRight': 10, 'marginBottom': 10, 'marginTop': 25}), 
+view_title = html.H5(children='Show:', style={'marginLeft': 10, 'marginRight': 10, 'marginBottom': 10, 'marginTop': 25}), 
+release_footer = html.H6(
+    id='release_footer', 
+    children=f'Data from Global Oil and Gas Plant Tracker, {release_date} release',
+)
 download_text = html.H6(children='Download figure data:')
 download_button = html.Button("Download Excel file", id="btn_xlsx"),
 
@@ -541,10 +944,12 @@ if layout_chosen == '1 column':
     # 1-column version
     app.layout = dbc.Container(fluid=True, children=[
         dbc.Row([dbc.Col(country_dropdown)], align='center'),
+        dbc.Row([dbc.Col(view_radio)], align='center'),
         dbc.Row([dbc.Col(choro_graph)], align='center'),
         dbc.Row([dbc.Col(status_graph)], align='center'),
         dbc.Row([dbc.Col(age_graph)], align='center'),
         dbc.Row([dbc.Col(add_graph)], align='center'),
+        dbc.Row([dbc.Col(release_footer)], align='center'),
     ],
     )
 elif layout_chosen == '2 columns':
@@ -556,7 +961,11 @@ elif layout_chosen == '2 columns':
                 dbc.Row(dropdown_title),
                 dbc.Row(country_dropdown),
             ], md=4),
-            dbc.Col([], xl=5) # spacer
+            dbc.Col([
+                dbc.Row(view_title),
+                dbc.Row(view_radio),
+            ], md=4),
+            dbc.Col([], xl=1) # spacer
             # # section for download button:
             # dbc.Col([
             #     dbc.Row(download_text),
@@ -575,7 +984,7 @@ elif layout_chosen == '2 columns':
         ]),
         dbc.Row([
             dbc.Col([
-                html.H6(f'Data from Global Oil and Gas Plant Tracker, {release_date} release'),
+                release_footer,
             ], align="evenly"),
         ]),
     ],
@@ -587,24 +996,44 @@ elif layout_chosen == '2 columns':
     Output('chart_age', 'figure'),
     Output('chart_add', 'figure'),
     Input('country_dropdown', 'value'), 
+    Input('view_radio', 'value'), 
 )
-def update_figure(sel_country):
-    fig_map = create_chart_choro(
-        gogpt_map=gogpt_map, 
-        sel_country=sel_country
-    )
-    fig_status = create_chart_by_status(
-        gogpt_status=gogpt_status, 
-        sel_country=sel_country
-    )
-    fig_age = create_chart_age_type(
-        gogpt_age=gogpt_age,
-        sel_country=sel_country
-    )
-    fig_add = create_chart_additions(
-        gogpt_add=gogpt_add, 
-        sel_country=sel_country
-    )
+def update_figure(sel_country, sel_view):
+    if sel_view == 'change':
+        fig_map = create_chart_choro_delta(
+            gogpt_map_delta=gogpt_map_delta, 
+            sel_country=sel_country
+        )
+        fig_status = create_chart_by_status_delta(
+            gogpt_status_delta=gogpt_status_delta, 
+            sel_country=sel_country,
+            status_snapshot_years=status_snapshot_years,
+        )
+        fig_age = create_chart_age_type_delta(
+            gogpt_age_delta=gogpt_age_delta,
+            sel_country=sel_country
+        )
+        fig_add = create_chart_additions_delta(
+            gogpt_add_delta=gogpt_add_delta, 
+            sel_country=sel_country
+        )
+    else:
+        fig_map = create_chart_choro(
+            gogpt_map=gogpt_map, 
+            sel_country=sel_country
+        )
+        fig_status = create_chart_by_status(
+            gogpt_status=gogpt_status, 
+            sel_country=sel_country
+        )
+        fig_age = create_chart_age_type(
+            gogpt_age=gogpt_age,
+            sel_country=sel_country
+        )
+        fig_add = create_chart_additions(
+            gogpt_add=gogpt_add, 
+            sel_country=sel_country
+        )
     fig_map.update_layout(transition_duration=500)
     fig_status.update_layout(transition_duration=500)
     fig_age.update_layout(transition_duration=500)
@@ -612,6 +1041,28 @@ def update_figure(sel_country):
 
     return fig_map, fig_status, fig_age, fig_add
 
+
+@app.callback(
+    Output('country_dropdown', 'options'),
+    Output('country_dropdown', 'value'),
+    Output('release_footer', 'children'),
+    Input('view_radio', 'value'), 
+    State('country_dropdown', 'value'),
+)
+def update_view(sel_view, sel_country):
+    if sel_view == 'change':
+        options = dropdown_options_change
+        footer = f'Data from Global Oil and Gas Plant Tracker, {release_date} and {compare_release_date} releases'
+    else:
+        options = dropdown_options_list_of_dicts
+        footer = f'Data from Global Oil and Gas Plant Tracker, {release_date} release'
+
+    # country only in the comparison release: go back to global view
+    if sel_country not in [option['value'] for option in options]:
+        sel_country = 'all'
+
+    return options, sel_country, footer
+
 # # Section for download file
 # @app.callback(
 #     Output("download-dataframe-xlsx", "data"), # for download button